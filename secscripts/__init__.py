@@ -0,0 +1,17 @@
+"""
+Security tooling that can be run from the command line with
+``python3 -m secscripts <command>`` or imported and called directly. Heavy
+third party libraries are only imported by the functions that need them.
+"""
+
+class UsageError(Exception):
+    """
+    Raised by a command when its arguments cannot be used, the command line
+    entry point reports it as a usage error.
+    """
+
+class CommandError(Exception):
+    """
+    Raised by a command that ran but could not complete, the command line
+    entry point reports it as an error and exits with a failure status.
+    """
@@ -0,0 +1,3 @@
+from secscripts.cli import main
+
+main()
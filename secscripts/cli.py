@@ -0,0 +1,45 @@
+"""
+Single entry point for every subcommand.
+"""
+import argparse
+import sys
+from secscripts import CommandError, UsageError, convox_audit, crt_dns, profiling, ssl_artifacting, ubuntu_cve
+
+COMMANDS = [
+    ("ubuntu-cve", ubuntu_cve, "Report the Ubuntu patch status of CloudPassage SVA issues"),
+    ("crt-dns", crt_dns, "Resolve the names on certificates logged in crt.sh"),
+    ("convox-audit", convox_audit, "Export Convox console audit logs from DynamoDB"),
+    ("ssl-artifacting", ssl_artifacting, "Run sslscan or testssl.sh against hosts from scan results"),
+]
+
+def build_parser(prog="secscripts"):
+    """
+    Builds the argument parser with a subparser for every command.
+    """
+    cmdparser = argparse.ArgumentParser(prog=prog)
+    subparsers = cmdparser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for name, module, description in COMMANDS:
+        subparser = subparsers.add_parser(name, help=description, description=description)
+        module.add_arguments(subparser)
+        profiling.add_arguments(subparser)
+        subparser.set_defaults(run=module.run, parser=subparser)
+    return cmdparser
+
+def main(argv=None):
+    """
+    Parses argv and runs the selected command.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    cmdargs = build_parser().parse_args(argv)
+    profiling.start(cmdargs, argv)
+    try:
+        cmdargs.run(cmdargs)
+    except UsageError as exc:
+        cmdargs.parser.error(str(exc))
+    except CommandError as exc:
+        cmdargs.parser.exit(1, "{0}: error: {1}\n".format(cmdargs.parser.prog, exc))
+    finally:
+        # Written even when the command fails, a partial profile is still useful.
+        profiling.write_report(cmdargs)
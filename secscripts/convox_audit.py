@@ -0,0 +1,199 @@
+"""
+Pulls Convox console audit logs out of DynamoDB.
+"""
+import concurrent.futures
+import datetime
+import json
+import csv
+import threading
+from secscripts import CommandError, UsageError, profiling
+
+AUDIT_TABLE = 'console-private-audit-logs'
+ORGANIZATION_TABLE = 'console-private-organizations'
+RACK_TABLE = 'console-private-racks'
+USERS_TABLE = 'console-private-users'
+
+# Sessions are expensive to build so idle ones are kept for the life of the
+# process, keyed by (profile, region). boto3 sessions and resources are not
+# thread safe, so a session is checked out by one worker at a time and only
+# returned to the pool once that worker is done with it.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def checkout_session(profile, region=None):
+  import boto3
+  with _sessions_lock:
+    if _sessions.get((profile, region)):
+      return _sessions[(profile, region)].pop()
+  # Built outside the lock so accounts do not wait on each others STS calls.
+  session = boto3.session.Session(profile_name=profile, region_name=region)
+  account = session.client('sts').get_caller_identity()['Account']
+  return (account, session.region_name, session.resource('dynamodb'))
+
+def checkin_session(profile, region, pooled):
+  with _sessions_lock:
+    _sessions.setdefault((profile, region), []).append(pooled)
+
+def get_exec_audit_logs(dynamodb, start_date, end_date, path_filter):
+  from boto3.dynamodb.conditions import Attr
+  audit_table = dynamodb.Table(AUDIT_TABLE)
+  audit_lines = []
+  start_period = "{0}.000000.000000000".format(start_date.strftime('%Y%m%d'))
+  end_period = "{0}.999999.999999999".format(end_date.strftime('%Y%m%d'))
+  if path_filter == "all_logs":
+    expression = Attr('timestamp').between(start_period, end_period)
+  else:
+    expression = Attr('path').contains(path_filter)&Attr('timestamp').between(start_period, end_period)
+  with profiling.stage("dynamodb_scan"):
+    response = audit_table.scan(FilterExpression=expression)
+  profiling.count("dynamodb_pages")
+  audit_lines.extend(response['Items'])
+  while 'LastEvaluatedKey' in response:
+    with profiling.stage("dynamodb_scan"):
+      response = audit_table.scan(FilterExpression=expression, ExclusiveStartKey=response['LastEvaluatedKey'])
+    profiling.count("dynamodb_pages")
+    audit_lines.extend(response['Items'])
+  profiling.count("audit_events", len(audit_lines))
+  return audit_lines
+
+def get_organization_mapping(dynamodb):
+  organization_table = dynamodb.Table(ORGANIZATION_TABLE)
+  organization_lines = []
+  with profiling.stage("dynamodb_scan"):
+    response = organization_table.scan()
+  profiling.count("dynamodb_pages")
+  organization_lines.extend(response['Items'])
+  while 'LastEvaluatedKey' in response:
+    with profiling.stage("dynamodb_scan"):
+      response = organization_table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+    profiling.count("dynamodb_pages")
+    organization_lines.extend(response['Items'])
+  org_mapping = {}
+  for org in organization_lines:
+    org_mapping[org['id']] = org['name']
+  return org_mapping
+
+def get_rack_mapping(dynamodb):
+  rack_table = dynamodb.Table(RACK_TABLE)
+  rack_lines = []
+  with profiling.stage("dynamodb_scan"):
+    response = rack_table.scan()
+  profiling.count("dynamodb_pages")
+  rack_lines.extend(response['Items'])
+  while 'LastEvaluatedKey' in response:
+    with profiling.stage("dynamodb_scan"):
+      response = rack_table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+    profiling.count("dynamodb_pages")
+    rack_lines.extend(response['Items'])
+  rack_mapping = {}
+  for rack in rack_lines:
+    rack_mapping[rack['id']] = rack['name']
+  return rack_mapping
+
+def get_user_mapping(dynamodb):
+  users_table = dynamodb.Table(USERS_TABLE)
+  user_lines = []
+  with profiling.stage("dynamodb_scan"):
+    response = users_table.scan()
+  profiling.count("dynamodb_pages")
+  user_lines.extend(response['Items'])
+  while 'LastEvaluatedKey' in response:
+    with profiling.stage("dynamodb_scan"):
+      response = users_table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+    profiling.count("dynamodb_pages")
+    user_lines.extend(response['Items'])
+  user_mapping = {}
+  for user in user_lines:
+    user_mapping[user['id']] = user['email']
+  return user_mapping
+
+def map_log_event_to_email(dynamodb, log_events, convox_host):
+  org_map = get_organization_mapping(dynamodb)
+  rack_map = get_rack_mapping(dynamodb)
+  user_map = get_user_mapping(dynamodb)
+  with profiling.stage("enrich"):
+    for event in log_events:
+      event['playback_url'] = ""
+      if event['path'].endswith("/exec"):
+        if convox_host:
+          event['playback_url'] = "https://{host}/grid/organizations/{org_id}/racks/{rack_id}/audit_logs/{event_id}/artifact/playback".format(host=convox_host, org_id=event['organization'], rack_id=event['rack'], event_id=event['id'])
+        else:
+          event['playback_url'] = "/grid/organizations/{org_id}/racks/{rack_id}/audit_logs/{event_id}/artifact/playback".format(org_id=event['organization'], rack_id=event['rack'], event_id=event['id'])
+      event['organization'] = org_map[event['organization']]
+      event['rack'] = rack_map[event['rack']]
+      event['user'] = user_map[event['user']]
+  return log_events
+
+def pull_account(profile, region, start_date, end_date, path_filter, convox_host):
+  pooled = checkout_session(profile, region)
+  account, session_region, dynamodb = pooled
+  try:
+    with profiling.stage("collect"):
+      exec_logs = get_exec_audit_logs(dynamodb, start_date, end_date, path_filter)
+    with profiling.stage("format"):
+      formatted_logs = map_log_event_to_email(dynamodb, exec_logs, convox_host)
+  finally:
+    checkin_session(profile, region, pooled)
+  for event in formatted_logs:
+    event['account'] = account
+    event['region'] = session_region
+  return formatted_logs
+
+def pull_accounts(profiles, regions, start_date, end_date, path_filter, convox_host, workers=None):
+  # Every profile is pulled in every region at the same time, the same console
+  # reached through two profiles is only reported once. Returns the merged
+  # events and the (profile, region) targets that could not be pulled.
+  targets = list(dict.fromkeys((profile, region) for profile in profiles for region in (regions or [None])))
+  merged = {}
+  failed = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(targets)) as executor:
+    future_to_target = {executor.submit(profiling.profiled(pull_account), profile, region, start_date, end_date, path_filter, convox_host): (profile, region) for profile, region in targets}
+    for future in concurrent.futures.as_completed(future_to_target):
+      profile, region = future_to_target[future]
+      try:
+        for event in future.result():
+          merged[(event['account'], event['region'], event['id'])] = event
+      except Exception as exc:
+        print('{0} ({1}) generated an exception: {2}'.format(profile, region or "default region", exc))
+        failed.append((profile, region))
+  return sorted(merged.values(), key=lambda event: event['timestamp']), failed
+
+def json_out(filename, json_data, format="json"):
+  if format == "csv":
+    # Events from different consoles do not always carry the same attributes.
+    header = list(dict.fromkeys(key for row in json_data for key in row))
+    with open(filename, 'w', newline='') as file_handler:
+      csv_writer = csv.DictWriter(file_handler, fieldnames=header, restval="")
+      csv_writer.writeheader()
+      csv_writer.writerows(json_data)
+  elif format == "json":
+    with open(filename, "w") as file_handler:
+      json.dump(json_data, file_handler, indent=2)
+
+def add_arguments(cmdparser):
+  cmdparser.add_argument("-d", "--days", default="7", help="Number of days to go back into logs (default: 7)", type=int)
+  cmdparser.add_argument("-p", "--path", default="exec", help="Specific convox path to filter by (default: exec)")
+  cmdparser.add_argument("--profile", default=["default"], nargs='*', help="AWS profile name(s) used to connect to dynamodb (default: default)")
+  cmdparser.add_argument("--region", default=[], nargs='*', help="AWS region(s) to pull from with every profile (default: the profile's region)")
+  cmdparser.add_argument("--threads", default=0, type=int, help="The number of accounts to pull at once (default: all of them)")
+  cmdparser.add_argument("--host", default=False, help="Hostname of convox console to built playback urls (default: None)")
+
+def run(cmdargs):
+  if not cmdargs.profile:
+    raise UsageError("at least one --profile is required")
+  end_date = datetime.date.today()
+  start_date = end_date - datetime.timedelta(days=cmdargs.days)
+  print("\033[92m[+] Collecting and formating log files from {0} account(s)\033[0m".format(len(cmdargs.profile)))
+  with profiling.stage("pull"):
+    formatted_logs, failed = pull_accounts(cmdargs.profile, cmdargs.region, start_date, end_date, cmdargs.path, cmdargs.host, cmdargs.threads)
+  missing = ", ".join("{0} ({1})".format(profile, region or "default region") for profile, region in failed)
+  if formatted_logs:
+    # A partial export is still written, but its name says so and the run fails.
+    filename = "convox_{path}_audit_{start}-{end}{partial}.csv".format(path=cmdargs.path, start=start_date.strftime('%Y%m%d'), end=end_date.strftime('%Y%m%d'), partial="_partial" if failed else "")
+    print("\033[92m[+] Generating output file {0}\033[0m".format(filename))
+    with profiling.stage("write"):
+      json_out(filename, formatted_logs, "csv")
+  else:
+    print("\033[92m[+] No matching log files were found\033[0m")
+  if failed:
+    raise CommandError("could not pull audit logs from {0}".format(missing))
@@ -0,0 +1,253 @@
+"""
+Harvests certificate names for domains from crt.sh and resolves them.
+"""
+import sqlite3
+import time
+from secscripts import UsageError, profiling
+
+RESOLVED = "resolved"
+NXDOMAIN = "nxdomain"
+NOANSWER = "noanswer"
+TIMEOUT = "timeout"
+SERVFAIL = "servfail"
+INVALID = "invalid"
+ERROR = "error"
+# Results that describe the name itself rather than the state of the network are worth caching.
+CACHEABLE = (RESOLVED, NXDOMAIN, NOANSWER, INVALID)
+DEFAULT_CACHE_TTL = 60 * 60
+
+def create_cache(db):
+  """
+  Creates the answer cache database if it does not already exist.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("create table if not exists answers(host text primary key, result text, answer text, expires real)")
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def read_cache(db, hosts):
+  """
+  Returns the unexpired cached (result, answer) pairs for the given hosts.
+  """
+  answers = {}
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  for host in hosts:
+    cursor.execute("select result, answer from answers where host = ? and expires > ?", (host, time.time()))
+    row = cursor.fetchone()
+    if row:
+      answers[host] = row
+  cursor.close()
+  conn.close()
+  return answers
+
+def write_cache(db, answers, ttl=DEFAULT_CACHE_TTL):
+  """
+  Stores the cacheable answers of a run.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  expires = time.time() + ttl
+  cursor.executemany("insert or replace into answers values (?, ?, ?, ?)", [(host, result, answer, expires) for host, (result, answer) in answers.items() if result in CACHEABLE])
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def build_resolver(nameservers=None, port=53, timeout=5.0):
+  """
+  Creates an async resolver, optionally pointed at specific nameservers such
+  as a local stub server.
+  """
+  from dns import asyncresolver
+  dns_resolver = asyncresolver.Resolver(configure=not nameservers)
+  if nameservers:
+    dns_resolver.nameservers = nameservers
+  dns_resolver.port = port
+  dns_resolver.lifetime = timeout
+  return dns_resolver
+
+async def resolve_host(dns_resolver, semaphore, host):
+  """
+  Resolves a single host and classifies the outcome. Returns a (result, answer)
+  pair where answer is the canonical name for resolved hosts.
+  """
+  from dns import exception, name, resolver
+  async with semaphore:
+    try:
+      answer = await dns_resolver.resolve(host)
+      return (RESOLVED, str(answer.canonical_name))
+    except resolver.NXDOMAIN:
+      return (NXDOMAIN, "")
+    except resolver.NoAnswer:
+      return (NOANSWER, "")
+    except exception.Timeout:
+      return (TIMEOUT, "")
+    except resolver.NoNameservers:
+      return (SERVFAIL, "")
+    except (name.EmptyLabel, name.LabelTooLong, name.NameTooLong, resolver.YXDOMAIN):
+      return (INVALID, "")
+    except exception.DNSException as exc:
+      # Anything else only affects this name, it must not take down the rest of the run.
+      return (ERROR, str(exc))
+
+async def resolve_hosts(hosts, dns_resolver, concurrency=50):
+  """
+  Resolves every host with at most concurrency queries in flight.
+  """
+  import asyncio
+  semaphore = asyncio.Semaphore(concurrency)
+  hosts = list(hosts)
+  results = await asyncio.gather(*[resolve_host(dns_resolver, semaphore, host) for host in hosts])
+  return dict(zip(hosts, results))
+
+def resolve_all(hosts, dns_resolver, concurrency=50, cache=None, ttl=DEFAULT_CACHE_TTL):
+  """
+  Resolves every host, answering from the on-disk cache where possible and
+  only querying names that are not cached. Duplicate names are only resolved
+  once per run.
+  """
+  import asyncio
+  hosts = set(hosts)
+  answers = {}
+  if cache:
+    create_cache(cache)
+    answers = read_cache(cache, hosts)
+  pending = hosts - set(answers)
+  profiling.count("cache_hit", len(answers))
+  with profiling.stage("resolve"):
+    fresh = asyncio.run(resolve_hosts(pending, dns_resolver, concurrency))
+  for result, answer in fresh.values():
+    profiling.count(result)
+  if cache:
+    write_cache(cache, fresh, ttl)
+  answers.update(fresh)
+  return answers
+
+def create_store(db):
+  """
+  Creates the harvest store that remembers which crt.sh certificates and
+  names have already been processed.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("create table if not exists certs(id integer primary key, domain text)")
+  cursor.execute("create table if not exists names(name text primary key, domain text)")
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def search_certs(domain):
+  """
+  Queries crt.sh for every certificate issued for a domain.
+  """
+  from crtsh import crtshAPI
+  with profiling.stage("crtsh"):
+    certs = crtshAPI().search(domain)
+  return certs[0]
+
+def normalize_names(name_value):
+  """
+  Splits a crt.sh name_value into its individual SANs, lower cases them and
+  collapses wildcards onto the name they cover. Names that are not valid DNS
+  names, such as ones with empty or overlong labels, are dropped.
+  """
+  names = set()
+  for name in name_value.splitlines():
+    name = name.strip().lower().rstrip('.')
+    while name.startswith('*.'):
+      name = name[2:]
+    if name and len(name) <= 253 and all(0 < len(label) <= 63 for label in name.split('.')):
+      names.add(name)
+  return names
+
+def harvest_domain(db, domain):
+  """
+  Returns the names from certificates of a domain that have not been seen in
+  a previous run, along with the ids of the new certificates.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cert_ids = []
+  names = set()
+  for cert in search_certs(domain):
+    cursor.execute("select 1 from certs where id = ?", (cert['id'],))
+    if cursor.fetchone():
+      continue
+    cert_ids.append(cert['id'])
+    names.update(normalize_names(cert['name_value']))
+  new_names = set()
+  for name in names:
+    cursor.execute("select 1 from names where name = ?", (name,))
+    if not cursor.fetchone():
+      new_names.add(name)
+  cursor.close()
+  conn.close()
+  return cert_ids, new_names
+
+def record_harvest(db, domain, cert_ids, names):
+  """
+  Marks certificates and names as processed once they have been resolved.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.executemany("insert or ignore into certs values (?, ?)", [(cert_id, domain) for cert_id in cert_ids])
+  cursor.executemany("insert or ignore into names values (?, ?)", [(name, domain) for name in names])
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def add_arguments(cmdparser):
+  """
+  Adds the crt-dns options to a subcommand parser.
+  """
+  cmdparser.add_argument("-d", "--domain", default=[], nargs='*', help="Domain(s) to search crt.sh for")
+  cmdparser.add_argument("-i", "--input", default=[], nargs='*', help="File(s) with one domain to search per line")
+  cmdparser.add_argument("--store", default="crt_harvest.db", help="Database of certificates and names already processed (default: crt_harvest.db)")
+  cmdparser.add_argument("--concurrency", default=50, type=int, help="The number of DNS queries in flight at once (default: 50)")
+  cmdparser.add_argument("--timeout", default=5.0, type=float, help="Seconds before a single query is classed as a timeout (default: 5)")
+  cmdparser.add_argument("--nameserver", default=[], nargs='*', help="Nameserver(s) to query instead of the system resolver")
+  cmdparser.add_argument("--port", default=53, type=int, help="Port the nameservers listen on (default: 53)")
+  cmdparser.add_argument("--cache", default="crt_dns_cache.db", help="Database used to cache answers between runs (default: crt_dns_cache.db)")
+  cmdparser.add_argument("--cache-ttl", default=1, type=float, help="Hours a cached answer is used before it is queried again (default: 1)")
+
+def harvest_and_resolve(cmdargs, dns_resolver, domain):
+  """
+  Harvests, resolves and records the new names of a single domain.
+  """
+  cert_ids, hosts = harvest_domain(cmdargs.store, domain)
+  print("{0}: {1} new certificates, {2} new names".format(domain, len(cert_ids), len(hosts)))
+  answers = resolve_all(hosts, dns_resolver, cmdargs.concurrency, cmdargs.cache, cmdargs.cache_ttl * 60 * 60)
+  for host in sorted(answers):
+    result, answer = answers[host]
+    if result == RESOLVED:
+      print("{0}: {1}".format(host, answer))
+    else:
+      print("{0} failed ({1})".format(host, result))
+  # Certificates are only marked as seen once every name on them got a definite answer,
+  # otherwise names that timed out would never be retried.
+  settled = [host for host in answers if answers[host][0] in CACHEABLE]
+  if len(settled) < len(answers):
+    cert_ids = []
+  record_harvest(cmdargs.store, domain, cert_ids, settled)
+
+def run(cmdargs):
+  """
+  Runs the crt-dns subcommand.
+  """
+  domains = list(cmdargs.domain)
+  for file in cmdargs.input:
+    with open(file, 'r') as file_handler:
+      domains = domains + [line.strip() for line in file_handler if line.strip()]
+  if not domains:
+    raise UsageError("at least one domain is required, use -d or -i")
+
+  create_store(cmdargs.store)
+  dns_resolver = build_resolver(cmdargs.nameserver, cmdargs.port, cmdargs.timeout)
+  for domain in domains:
+    try:
+      harvest_and_resolve(cmdargs, dns_resolver, domain)
+    except Exception as exc:
+      # One bad domain should not stop the rest of the batch.
+      print('{0} generated an exception: {1}'.format(domain, exc))
@@ -0,0 +1,187 @@
+"""
+Shared stage timing, counters and optional cProfile/tracemalloc capture for
+the subcommands. Every subcommand exposes it with --profile-out, and nothing
+is recorded unless that flag is given.
+"""
+import contextlib
+import datetime
+import functools
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_enabled = False
+_started = None
+_command = None
+_stages = {}
+_counters = {}
+_profiler = None
+_worker_stats = None
+_run = 0
+_memory = False
+
+def add_arguments(parser):
+    """
+    Adds the --profile-out, --profile-cpu and --profile-memory options to a
+    subcommand parser.
+    """
+    parser.add_argument("--profile-out", default="", help="Write a JSON report of stage timings and counters to this file")
+    parser.add_argument("--profile-cpu", action="store_true", help="Include a cProfile summary of the main thread and the worker threads of the subcommand in the report, on Python 3.12+ calls that overlap across threads are only approximate")
+    parser.add_argument("--profile-memory", action="store_true", help="Include tracemalloc allocation statistics in the report")
+
+def _reset():
+    """
+    Drops everything recorded by a previous run in this process.
+    """
+    global _enabled, _started, _command, _stages, _counters, _profiler, _worker_stats, _run, _memory
+    if _profiler is not None:
+        _profiler.disable()
+    if _memory:
+        import tracemalloc
+        tracemalloc.stop()
+    _enabled = False
+    _started = None
+    _command = None
+    _stages = {}
+    _counters = {}
+    _profiler = None
+    with _lock:
+        _worker_stats = None
+        _run += 1
+    _memory = False
+
+def start(cmdargs, argv=None):
+    """
+    Starts recording if --profile-out was given. argv is the command line the
+    subcommand was parsed from, recorded in the report, and defaults to the
+    arguments of the process. Anything left over from a previous run in the
+    same process is discarded first.
+    """
+    global _enabled, _started, _command, _profiler, _memory
+    _reset()
+    if not cmdargs.profile_out:
+        return
+    _enabled = True
+    _started = time.perf_counter()
+    _command = list(sys.argv[1:] if argv is None else argv)
+    if cmdargs.profile_cpu:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if cmdargs.profile_memory:
+        import tracemalloc
+        _memory = True
+        tracemalloc.start()
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the wrapped block and adds it to the named stage. Safe to use from
+    worker threads, overlapping stages simply add up.
+    """
+    if not _enabled:
+        yield
+        return
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - begin
+        with _lock:
+            entry = _stages.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+            entry["calls"] += 1
+            entry["total"] += elapsed
+            entry["max"] = max(entry["max"], elapsed)
+
+def profiled(function):
+    """
+    Wraps a function that is submitted to a worker thread so its calls are
+    included in the --profile-cpu summary. Before 3.12 cProfile only sees the
+    thread that enabled it, so the worker thread enables a profiler of its own
+    for the duration of each call and disables it again itself, nothing is
+    left profiling the thread once the call returns. From 3.12 the main
+    profiler already sees every thread through sys.monitoring, but keeps a
+    single call stack and refuses a second profiler, so calls that overlap
+    across threads are only approximate.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global _worker_stats
+        if _profiler is None or sys.version_info >= (3, 12) or sys.getprofile() is not None:
+            return function(*args, **kwargs)
+        import cProfile
+        import io
+        import pstats
+        run = _run
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            with _lock:
+                # A call that finishes after the report was written is dropped.
+                if run == _run:
+                    if _worker_stats is None:
+                        _worker_stats = stats
+                    else:
+                        _worker_stats.add(stats)
+    return wrapper
+
+def count(name, amount=1):
+    """
+    Adds amount to the named counter.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def write_report(cmdargs, top=25):
+    """
+    Stops any capture that is running and writes the JSON report to the file
+    given with --profile-out.
+    """
+    if not _enabled or not cmdargs.profile_out:
+        _reset()
+        return
+    import io
+    import json
+    import pstats
+    import tracemalloc
+    report = {
+        "command": _command,
+        "finished": datetime.datetime.now().isoformat(),
+        "wall_time": time.perf_counter() - _started,
+        "stages": _stages,
+        "counters": _counters,
+    }
+    if _profiler is not None:
+        _profiler.disable()
+        stats = pstats.Stats(_profiler, stream=io.StringIO())
+        with _lock:
+            # Only finished calls are included, a profiler can only be stopped
+            # by the thread that is running it.
+            if _worker_stats is not None:
+                stats.add(_worker_stats)
+        functions = []
+        for (filename, line, function), (calls, primitive, total, cumulative, callers) in stats.stats.items():
+            functions.append({"function": "{0}:{1}({2})".format(filename, line, function), "calls": calls, "total": total, "cumulative": cumulative})
+        if sys.version_info < (3, 12):
+            report["cprofile_threads"] = "per-thread, calls still running are left out"
+        else:
+            report["cprofile_threads"] = "shared, overlapping calls across threads are approximate"
+        report["cprofile"] = sorted(functions, key=lambda entry: entry["cumulative"], reverse=True)[:top]
+    if _memory:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {
+            "current": current,
+            "peak": peak,
+            "top": [{"location": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in snapshot.statistics("lineno")[:top]],
+        }
+    _reset()
+    with open(cmdargs.profile_out, "w") as file_handler:
+        json.dump(report, file_handler, indent=2)
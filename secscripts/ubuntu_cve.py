@@ -0,0 +1,527 @@
+"""
+Reports whether the packages behind CloudPassage SVA issues have been patched
+in the supported Ubuntu releases.
+"""
+import concurrent.futures
+import glob
+import os
+import re
+import sqlite3
+import time
+import xml.etree.ElementTree as etree
+from secscripts import UsageError, profiling
+
+UBUNTU_CVE_URL = 'https://people.canonical.com/~ubuntu-security/cve/{0}/{1}.html'
+# How long a cached page is trusted before it is revalidated with the tracker.
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+# Ubuntu releases that are reported on by default.
+UBUNTU_RELEASES = ["16.04", "18.04", "20.04", "22.04"]
+# Codenames used by the tracker and OVAL data for the releases above.
+UBUNTU_CODENAMES = {"xenial": "16.04", "bionic": "18.04", "focal": "20.04", "jammy": "22.04"}
+# ubuntu-cve-tracker lines look like "xenial_openssl: released (1.0.2g-1ubuntu4.6)", releases
+# past standard support also have "esm-infra/xenial_openssl: released (1.0.2g-1ubuntu4.20+esm1)"
+TRACKER_STATUS_LINE = re.compile(r'^(esm-[a-z]+/)?([a-z]+)_(\S+?):\s*([\w-]+)')
+# OVAL criterion comments look like "openssl package in xenial was vulnerable but has been fixed (note: '...')."
+OVAL_COMMENT = re.compile(r'^(\S+) package in (\w+) (.*)$')
+OVAL_STATUSES = [
+  ("has been fixed", "released"),
+  ("decision has been made to defer", "deferred"),
+  ("may need fixing", "needs-triage"),
+  ("needs fixing", "needed"),
+  ("not affected", "not-affected"),
+]
+OVAL_NS = '{http://oval.mitre.org/XMLSchema/oval-definitions-5}'
+# Halo issue filter used to only pull issues seen since the previous sync.
+ISSUE_SINCE_FILTER = 'last_seen_at_gte'
+# Statuses that will not change any more, other statuses are looked up again after the ttl.
+FINAL_STATUSES = ["released", "not-affected", "DNE"]
+
+def get_sva_cves(issue_list):
+  """
+  Builds a mapping of package name to the sorted list of CVE ids reported
+  against it by the SVA issues.
+  """
+  all_cves = {}
+  for issue in issue_list:
+    if issue['issue_type'] == 'sva':
+      all_cves.setdefault(issue['package_name'], set()).update(issue['cve_ids'])
+  for package in all_cves:
+    all_cves[package] = sorted(all_cves[package])
+  return all_cves
+
+def create_store(db):
+  """
+  Creates the local issue store if it does not already exist. Issues are
+  indexed by package, CVE and affected server, and every (package, CVE,
+  release) that has been looked up is remembered along with when it was
+  looked up and whether its statuses are final.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("create table if not exists issues(id text primary key, package text, server text, status text, last_seen text)")
+  cursor.execute("create table if not exists issue_cves(issue_id text, cve text, primary key (issue_id, cve))")
+  cursor.execute("create table if not exists checked(package text, cve text, release text, final integer, checked_at real, primary key (package, cve, release))")
+  cursor.execute("create table if not exists statuses(package text, source text, cve text, release text, status text, primary key (package, source, cve, release))")
+  cursor.execute("create table if not exists syncinfo(last_seen text)")
+  cursor.execute("create index if not exists issues_package on issues(package)")
+  cursor.execute("create index if not exists issues_server on issues(server)")
+  cursor.execute("create index if not exists issue_cves_cve on issue_cves(cve)")
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def list_issues(issues, **filters):
+  """
+  Yields every issue matching the filters, following the API pagination until
+  it runs out. Issue.list_all stops silently after max_pages.
+  """
+  from cloudpassage import HttpHelper
+  request = HttpHelper(issues.session)
+  page = request.get(issues.endpoint(), params=filters)
+  while True:
+    items, next_page = request.process_page(page, issues.objects_name)
+    for item in items:
+      yield item
+    if next_page is None:
+      return
+    page = request.get(next_page)
+
+def sync_issues(db, issues, full=False):
+  """
+  Pulls the active and resolved SVA issues created or changed since the last
+  sync into the store and returns how many were updated. The newest
+  last_seen_at value reported by Halo is kept as the next starting point so
+  local clock skew does not matter, and it only moves once a pull completed.
+  A full sync pulls every active issue, marks issues that are no longer
+  reported, for example because their server was removed, as resolved and
+  forgets every lookup whose statuses were not final yet.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("select last_seen from syncinfo")
+  row = cursor.fetchone()
+  last_seen = row[0] if row else None
+  full = full or last_seen is None
+  if full:
+    filters = {'issue_type': 'sva', 'status': 'active'}
+  else:
+    filters = {'issue_type': 'sva', 'status': 'active,resolved', ISSUE_SINCE_FILTER: last_seen}
+  count = 0
+  seen = set()
+  try:
+    for issue in list_issues(issues, **filters):
+      if issue['issue_type'] != 'sva':
+        continue
+      issue_seen = issue.get('last_seen_at') or issue.get('created_at') or ""
+      cursor.execute("insert or replace into issues values (?, ?, ?, ?, ?)", (issue['id'], issue['package_name'], issue.get('agent_id'), issue.get('status'), issue_seen))
+      cursor.execute("delete from issue_cves where issue_id = ?", (issue['id'],))
+      cursor.executemany("insert or ignore into issue_cves values (?, ?)", [(issue['id'], cve) for cve in issue['cve_ids']])
+      if last_seen is None or issue_seen > last_seen:
+        last_seen = issue_seen
+      seen.add(issue['id'])
+      count += 1
+    if full:
+      cursor.execute("select id from issues where status is null or status != 'resolved'")
+      missing = [(issue_id,) for (issue_id,) in cursor.fetchall() if issue_id not in seen]
+      cursor.executemany("update issues set status = 'resolved' where id = ?", missing)
+      count += len(missing)
+      cursor.execute("delete from checked where final = 0")
+    cursor.execute("delete from syncinfo")
+    cursor.execute("insert into syncinfo values (?)", (last_seen,))
+    conn.commit()
+  finally:
+    # An interrupted pull is rolled back so the watermark never skips issues.
+    cursor.close()
+    conn.close()
+  return count
+
+def get_unchecked_cves(db, releases=UBUNTU_RELEASES, ttl=DEFAULT_CACHE_TTL):
+  """
+  Returns the package to CVE mapping of the pairs in the store that need a
+  lookup: a release was never looked up, or its statuses were not final and
+  were looked up longer than ttl seconds ago.
+  """
+  all_cves = {}
+  expired = time.time() - ttl
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("select package, cve, release, final, checked_at from checked")
+  checked = {}
+  for package, cve, release, final, checked_at in cursor.fetchall():
+    if final or checked_at > expired:
+      checked.setdefault((package, cve), set()).add(release)
+  cursor.execute("""select distinct issues.package, issue_cves.cve from issues
+    join issue_cves on issue_cves.issue_id = issues.id
+    where issues.status is null or issues.status != 'resolved'""")
+  for package, cve in cursor.fetchall():
+    if not checked.get((package, cve), set()).issuperset(releases):
+      all_cves.setdefault(package, []).append(cve)
+  cursor.close()
+  conn.close()
+  for package in all_cves:
+    all_cves[package] = sorted(all_cves[package])
+  return all_cves
+
+def store_statuses(db, results, releases=UBUNTU_RELEASES):
+  """
+  Replaces the statuses of the looked up pairs and records every requested
+  release as checked. A release is final once each of its statuses is in
+  FINAL_STATUSES, until then it is looked up again after the ttl. Pairs that
+  did not resolve, for example because the page could not be fetched, are
+  left to be retried.
+  """
+  statuses = {}
+  for package, source, cve, release, status in results:
+    statuses.setdefault((package, cve), {}).setdefault(release, []).append(status)
+  checked_at = time.time()
+  checked = []
+  for (package, cve), by_release in statuses.items():
+    for release in releases:
+      final = release in by_release and all(status in FINAL_STATUSES for status in by_release[release])
+      checked.append((package, cve, release, int(final), checked_at))
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.executemany("delete from statuses where package = ? and cve = ? and release = ?", [(package, cve, release) for package, cve, release, final, checked_at in checked])
+  cursor.executemany("insert or replace into statuses values (?, ?, ?, ?, ?)", results)
+  cursor.executemany("insert or replace into checked values (?, ?, ?, ?, ?)", checked)
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def read_store_statuses(db, releases=UBUNTU_RELEASES):
+  """
+  Returns the (package, source, cve, release, status) rows for every pair that is
+  still reported by an active issue.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("""select distinct statuses.package, statuses.source, statuses.cve, statuses.release, statuses.status from statuses
+    join issues on issues.package = statuses.package
+    join issue_cves on issue_cves.issue_id = issues.id and issue_cves.cve = statuses.cve
+    where issues.status is null or issues.status != 'resolved'
+    order by statuses.package, statuses.cve, statuses.source, statuses.release""")
+  results = [row for row in cursor.fetchall() if row[3] in releases]
+  cursor.close()
+  conn.close()
+  return results
+
+def build_http_session(workers):
+  """
+  Creates a keep-alive session with a connection pool large enough for every
+  worker thread to hold its own connection.
+  """
+  import requests
+  from requests.adapters import HTTPAdapter
+  http_session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+  http_session.mount('https://', adapter)
+  http_session.mount('http://', adapter)
+  return http_session
+
+def create_cache(db):
+  """
+  Creates the page cache database if it does not already exist.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("create table if not exists pages(cve text primary key, etag text, last_modified text, fetched real, content blob)")
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def read_cache(db, cve):
+  """
+  Returns the cached (etag, last_modified, fetched, content) row for a CVE or
+  None if the page has never been stored.
+  """
+  conn = sqlite3.connect(db, timeout=30)
+  cursor = conn.cursor()
+  cursor.execute("select etag, last_modified, fetched, content from pages where cve = ?", (cve,))
+  row = cursor.fetchone()
+  cursor.close()
+  conn.close()
+  return row
+
+def write_cache(db, cve, etag, last_modified, content):
+  """
+  Stores a freshly downloaded or revalidated page in the cache.
+  """
+  conn = sqlite3.connect(db, timeout=30)
+  cursor = conn.cursor()
+  cursor.execute("insert or replace into pages values (?, ?, ?, ?, ?)", (cve, etag, last_modified, time.time(), content))
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def fetch_cve_page(http_session, cve, cache=None, ttl=DEFAULT_CACHE_TTL, offline=False):
+  """
+  Downloads the Ubuntu security tracker page for a single CVE. When a cache
+  database is given, pages younger than the ttl are answered from it and
+  older ones are revalidated with a conditional request. In offline mode only
+  the cache is consulted and None is returned for pages that are not in it.
+  """
+  cached = read_cache(cache, cve) if cache else None
+  if offline:
+    return cached[3] if cached else None
+  if cached and time.time() - cached[2] < ttl:
+    profiling.count("cache_hit")
+    return cached[3]
+
+  headers = {}
+  if cached and cached[0]:
+    headers['If-None-Match'] = cached[0]
+  if cached and cached[1]:
+    headers['If-Modified-Since'] = cached[1]
+  url = UBUNTU_CVE_URL.format(cve.split("-")[1], cve)
+  with profiling.stage("http"):
+    resp = http_session.get(url, headers=headers, timeout=30)
+  if resp.status_code == 304 and cached:
+    profiling.count("cache_revalidated")
+    # The page has not changed, refresh the timestamp so it is trusted for another ttl.
+    write_cache(cache, cve, cached[0], cached[1], cached[3])
+    return cached[3]
+  resp.raise_for_status()
+  profiling.count("downloaded")
+  if cache:
+    write_cache(cache, cve, resp.headers.get('ETag'), resp.headers.get('Last-Modified'), resp.content)
+  return resp.content
+
+def parse_cve_page(content, releases=UBUNTU_RELEASES):
+  """
+  Parses the package status table of a CVE page in a single pass and returns
+  a mapping of package name to a mapping of release to status.
+  """
+  from bs4 import BeautifulSoup, SoupStrainer
+  matrix = {}
+  package = None
+  # Only the tables are built into a tree, the rest of the page is skipped while parsing.
+  page = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer('table'))
+  for row in page.find_all("tr"):
+    columns = row.find_all('td')
+    if not columns:
+      continue
+    label = columns[0].get_text(" ", strip=True)
+    # Each package block starts with a "Source: <package>" row.
+    if label.startswith("Source:"):
+      link = columns[0].find('a')
+      package = link.get_text(strip=True) if link else label.split()[1]
+      matrix.setdefault(package, {})
+      continue
+    if len(columns) < 2:
+      continue
+    release = next((release for release in releases if release in label), None)
+    status = columns[1].find('span')
+    if release and status:
+      matrix.setdefault(package, {})[release] = status.get_text(strip=True)
+  return matrix
+
+def create_index(db):
+  """
+  Creates the bulk status index database if it does not already exist.
+  """
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  cursor.execute("create table if not exists status(cve text, package text, release text, status text, primary key (cve, package, release)) without rowid")
+  conn.commit()
+  cursor.close()
+  conn.close()
+
+def read_tracker_statuses(tracker_path):
+  """
+  Yields (cve, package, release, status) for every supported release found in
+  the active and retired CVE files of an ubuntu-cve-tracker checkout. Once a
+  release is past standard support its plain line only says "ignored", so an
+  ESM line for the same package and release takes precedence.
+  """
+  for cve_file in glob.glob(os.path.join(tracker_path, "*", "CVE-*")):
+    cve = os.path.basename(cve_file)
+    statuses = {}
+    esm = set()
+    with open(cve_file, 'r', errors='replace') as file_handler:
+      for line in file_handler:
+        match = TRACKER_STATUS_LINE.match(line)
+        if not match or match.group(2) not in UBUNTU_CODENAMES:
+          continue
+        key = (match.group(3), UBUNTU_CODENAMES[match.group(2)])
+        if match.group(1):
+          if match.group(4) != "DNE":
+            esm.add(key)
+            statuses[key] = match.group(4)
+        elif key not in esm:
+          statuses[key] = match.group(4)
+    for (package, release), status in statuses.items():
+      yield (cve, package, release, status)
+
+def read_oval_statuses(oval_file):
+  """
+  Yields (cve, package, release, status) for every supported release found in
+  an Ubuntu CVE OVAL file. The file is streamed so large files are never held
+  in memory as a whole, every entry of the definitions, tests, objects,
+  states and variables sections is dropped as soon as it has been read.
+  """
+  # The open elements from the root down to the one being parsed.
+  path = []
+  for event, element in etree.iterparse(oval_file, events=('start', 'end')):
+    if event == 'start':
+      path.append(element)
+      continue
+    path.pop()
+    if element.tag == OVAL_NS + 'definition':
+      cves = [ref.get('ref_id') for ref in element.iter(OVAL_NS + 'reference') if ref.get('source') == 'CVE']
+      for criterion in element.iter(OVAL_NS + 'criterion'):
+        match = OVAL_COMMENT.match(criterion.get('comment', ''))
+        if not match or match.group(2) not in UBUNTU_CODENAMES:
+          continue
+        status = next((status for phrase, status in OVAL_STATUSES if phrase in match.group(3)), match.group(3).rstrip('.'))
+        for cve in cves:
+          yield (cve, match.group(1), UBUNTU_CODENAMES[match.group(2)], status)
+    if len(path) in (1, 2):
+      # An entry of a top level section, or the section itself, is complete.
+      path[-1].clear()
+
+def build_index(db, sources):
+  """
+  Builds the status index from ubuntu-cve-tracker checkouts and OVAL files.
+  Directories are treated as tracker checkouts, anything else as OVAL XML.
+  """
+  create_index(db)
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  for source in sources:
+    if os.path.isdir(source):
+      statuses = read_tracker_statuses(source)
+    else:
+      statuses = read_oval_statuses(source)
+    cursor.executemany("insert or replace into status values (?, ?, ?, ?)", statuses)
+  conn.commit()
+  cursor.execute("select count(*) from status")
+  count = cursor.fetchone()[0]
+  cursor.close()
+  conn.close()
+  return count
+
+def load_index(db, cves, releases=UBUNTU_RELEASES):
+  """
+  Loads the statuses of the given CVEs from the index into the same
+  cve -> package -> release -> status mapping produced by parse_cve_page.
+  """
+  pages = {}
+  conn = sqlite3.connect(db)
+  cursor = conn.cursor()
+  for cve in cves:
+    cursor.execute("select package, release, status from status where cve = ?", (cve,))
+    for package, release, status in cursor.fetchall():
+      if release in releases:
+        pages.setdefault(cve, {}).setdefault(package, {})[release] = status
+  cursor.close()
+  conn.close()
+  return pages
+
+def expand_statuses(all_cves, pages, releases=UBUNTU_RELEASES):
+  """
+  Fans the per CVE status matrices back out to each package that reported the
+  CVE. Returns a list of (package, source, cve, release, status) tuples where
+  source is the tracker package the status belongs to. CloudPassage reports
+  binary package names such as libssl1.0.0 while the tracker uses source
+  names such as openssl, so when the names differ every source package on
+  the page is reported as its own row rather than merged into one status.
+  """
+  results = []
+  for package in all_cves:
+    for cve in all_cves[package]:
+      matrix = pages.get(cve, {})
+      # When the tracker names the package differently report every block on the page.
+      sources = [package] if package in matrix else sorted(matrix, key=str)
+      for source in sources:
+        for release in releases:
+          if release in matrix[source]:
+            results.append((package, source or "", cve, release, matrix[source][release]))
+  return results
+
+def lookup_cves(all_cves, workers=10, cache=None, ttl=DEFAULT_CACHE_TTL, offline=False, releases=UBUNTU_RELEASES):
+  """
+  Looks up every distinct CVE once, concurrently over a pooled session, and
+  fans the results back out to each package that reported it. Returns a list
+  of (package, source, cve, release, status) tuples.
+  """
+  # A CVE reported against several packages only needs to be fetched once.
+  unique_cves = sorted(set(cve for cves in all_cves.values() for cve in cves))
+  pages = {}
+  if cache:
+    create_cache(cache)
+  http_session = build_http_session(workers)
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+      future_to_cve = {executor.submit(profiling.profiled(fetch_cve_page), http_session, cve, cache, ttl, offline): cve for cve in unique_cves}
+      for future in concurrent.futures.as_completed(future_to_cve):
+        cve = future_to_cve[future]
+        try:
+          content = future.result()
+          if content is None:
+            print('{0} is not in the cache'.format(cve))
+            continue
+          with profiling.stage("parse"):
+            pages[cve] = parse_cve_page(content, releases)
+        except Exception as exc:
+          print('{0} generated an exception: {1}'.format(cve, exc))
+  finally:
+    http_session.close()
+
+  return expand_statuses(all_cves, pages, releases)
+
+def add_arguments(cmdparser):
+  """
+  Adds the ubuntu-cve options to a subcommand parser.
+  """
+  cmdparser.add_argument("--api-key", default="cloud_passage_api_key", help="CloudPassage API key")
+  cmdparser.add_argument("--api-secret", default="cloud_passage_api_secret", help="CloudPassage API secret")
+  cmdparser.add_argument("--threads", default=10, type=int, help="The number of concurrent CVE lookups (default: 10)")
+  cmdparser.add_argument("--cache", default="ubuntu_cve_cache.db", help="Database used to cache Ubuntu CVE pages between runs (default: ubuntu_cve_cache.db)")
+  cmdparser.add_argument("--cache-ttl", default=24, type=float, help="Hours a cached page, or a status in --store that is not final yet, is used before it is looked up again (default: 24)")
+  cmdparser.add_argument("--releases", default=UBUNTU_RELEASES, nargs='*', help="Ubuntu releases to report on (default: {0})".format(" ".join(UBUNTU_RELEASES)))
+  cmdparser.add_argument("--index", default="", help="Status index database built with --build-index, used instead of the Ubuntu tracker")
+  cmdparser.add_argument("--build-index", default="", nargs='*', help="ubuntu-cve-tracker checkout(s) or Ubuntu OVAL XML file(s) to build --index from")
+  cmdparser.add_argument("--store", default="", help="Local issue store, only issues changed since the last sync are pulled and only new or unfinished package/CVE pairs are looked up")
+  cmdparser.add_argument("--full-sync", action="store_true", help="Pull every active issue into --store, resolve issues Halo no longer reports and look up every status that is not final again")
+  cmdparser.add_argument("--offline", action="store_true", help="Only answer from the page cache, never contact the Ubuntu tracker")
+
+def run(cmdargs):
+  """
+  Runs the ubuntu-cve subcommand.
+  """
+  if cmdargs.build_index:
+    if cmdargs.index == "":
+      raise UsageError("--build-index requires --index")
+    with profiling.stage("build_index"):
+      print("Indexed {0} statuses into {1}".format(build_index(cmdargs.index, cmdargs.build_index), cmdargs.index))
+    return
+  if cmdargs.threads < 1:
+    raise UsageError("--threads must be at least 1")
+  if cmdargs.offline and cmdargs.cache == "":
+    raise UsageError("--offline requires --cache")
+
+  import cloudpassage
+  session = cloudpassage.HaloSession(cmdargs.api_key, cmdargs.api_secret)
+  issues = cloudpassage.Issue(session)
+  if cmdargs.store:
+    create_store(cmdargs.store)
+    with profiling.stage("issues"):
+      print("Synced {0} changed issues into {1}".format(sync_issues(cmdargs.store, issues, cmdargs.full_sync), cmdargs.store))
+    all_cves = get_unchecked_cves(cmdargs.store, cmdargs.releases, cmdargs.cache_ttl * 60 * 60)
+  else:
+    with profiling.stage("issues"):
+      all_cves = get_sva_cves(list_issues(issues, issue_type='sva'))
+
+  if cmdargs.index:
+    unique_cves = set(cve for cves in all_cves.values() for cve in cves)
+    with profiling.stage("lookup"):
+      results = expand_statuses(all_cves, load_index(cmdargs.index, unique_cves, cmdargs.releases), cmdargs.releases)
+  else:
+    with profiling.stage("lookup"):
+      results = lookup_cves(all_cves, cmdargs.threads, cmdargs.cache, cmdargs.cache_ttl * 60 * 60, cmdargs.offline, cmdargs.releases)
+
+  if cmdargs.store:
+    store_statuses(cmdargs.store, results, cmdargs.releases)
+    results = read_store_statuses(cmdargs.store, cmdargs.releases)
+  for package, source, cve, release, status in results:
+    print("{0},{1},{2},{3},{4}".format(package, source, cve, release, status))
@@ -0,0 +1,53 @@
+"""
+Tests for running subcommands in process through the single entry point.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from secscripts import cli, ubuntu_cve
+
+class MainTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.tracker = os.path.join(self.directory.name, "tracker")
+    os.makedirs(self.tracker)
+    self.index = os.path.join(self.directory.name, "index.db")
+    self.report = os.path.join(self.directory.name, "report.json")
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def test_profile_state_does_not_leak_between_runs(self):
+    for _ in range(2):
+      cli.main(["ubuntu-cve", "--build-index", self.tracker, "--index", self.index, "--profile-out", self.report])
+      with open(self.report) as file_handler:
+        report = json.load(file_handler)
+      self.assertEqual(report["stages"]["build_index"]["calls"], 1)
+      self.assertEqual(report["command"], ["ubuntu-cve", "--build-index", self.tracker, "--index", self.index, "--profile-out", self.report])
+    # A run without --profile-out must not try to write a report.
+    cli.main(["ubuntu-cve", "--build-index", self.tracker, "--index", self.index])
+
+  def test_usage_errors_exit_with_usage(self):
+    with self.assertRaises(SystemExit):
+      cli.main(["ubuntu-cve", "--build-index", self.tracker])
+
+  def test_threads_must_be_positive(self):
+    with self.assertRaises(SystemExit):
+      cli.main(["ubuntu-cve", "--threads", "0"])
+
+  def test_offline_requires_cache(self):
+    with self.assertRaises(SystemExit):
+      cli.main(["ubuntu-cve", "--offline", "--cache", ""])
+
+  def test_other_errors_propagate_and_still_write_report(self):
+    with mock.patch.object(ubuntu_cve, "build_index", side_effect=ValueError("bad data")):
+      with self.assertRaises(ValueError):
+        cli.main(["ubuntu-cve", "--build-index", self.tracker, "--index", self.index, "--profile-out", self.report])
+    self.assertTrue(os.path.exists(self.report))
+
+if __name__ == "__main__":
+  unittest.main()
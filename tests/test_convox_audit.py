@@ -0,0 +1,67 @@
+"""
+Tests for merging Convox audit logs pulled from several accounts.
+"""
+import csv
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from secscripts import convox_audit
+
+def fake_events(dynamodb, start_date, end_date, path_filter):
+  if dynamodb == "broken":
+    raise RuntimeError("access denied")
+  return [{'id': '1', 'timestamp': '2', 'path': '/exec'}, {'id': '2', 'timestamp': '1', 'path': '/exec', 'extra': 'x'}]
+
+class PullAccountsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.in_use = set()
+    self.lock = threading.Lock()
+    patches = [
+      mock.patch.object(convox_audit, "checkout_session", side_effect=self.checkout),
+      mock.patch.object(convox_audit, "checkin_session", side_effect=self.checkin),
+      mock.patch.object(convox_audit, "get_exec_audit_logs", side_effect=fake_events),
+      mock.patch.object(convox_audit, "map_log_event_to_email", side_effect=lambda dynamodb, events, host: events),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def checkout(self, profile, region=None):
+    with self.lock:
+      # The same session must never be handed to two workers at once.
+      self.assertNotIn((profile, region), self.in_use)
+      self.in_use.add((profile, region))
+    account = "broken" if profile == "broken" else profile[:3]
+    return (account, region or "us-east-1", account)
+
+  def checkin(self, profile, region, pooled):
+    with self.lock:
+      self.in_use.discard((profile, region))
+
+  def test_merges_and_deduplicates_accounts(self):
+    events, failed = convox_audit.pull_accounts(["aaa1", "aaa2", "bbb", "bbb"], ["r1"], None, None, "exec", False)
+    self.assertEqual(failed, [])
+    self.assertEqual(sorted((event['account'], event['id']) for event in events), [("aaa", "1"), ("aaa", "2"), ("bbb", "1"), ("bbb", "2")])
+    self.assertEqual([event['timestamp'] for event in events], ["1", "1", "2", "2"])
+
+  def test_reports_failed_accounts(self):
+    events, failed = convox_audit.pull_accounts(["aaa", "broken"], [], None, None, "exec", False)
+    self.assertEqual(failed, [("broken", None)])
+    self.assertEqual(len(events), 2)
+
+  def test_csv_uses_every_field(self):
+    events, failed = convox_audit.pull_accounts(["aaa"], [], None, None, "exec", False)
+    with tempfile.TemporaryDirectory() as directory:
+      filename = os.path.join(directory, "out.csv")
+      convox_audit.json_out(filename, events, "csv")
+      with open(filename, newline='') as file_handler:
+        rows = list(csv.DictReader(file_handler))
+    self.assertEqual(set(rows[0]), {'id', 'timestamp', 'path', 'extra', 'account', 'region'})
+    self.assertEqual(sorted(row['extra'] for row in rows), ["", "x"])
+
+if __name__ == "__main__":
+  unittest.main()
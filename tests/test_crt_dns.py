@@ -0,0 +1,86 @@
+"""
+Runs the crt-dns resolver stage against a stub DNS server on localhost.
+"""
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+try:
+  import dns.message
+  import dns.rcode
+  import dns.rrset
+except ImportError:
+  dns = None
+
+from secscripts import crt_dns
+
+def serve_stub(sock):
+  """
+  Answers ok.example with an A record, missing.example with NXDOMAIN and
+  broken.example with SERVFAIL. slow.example is never answered.
+  """
+  while True:
+    try:
+      data, address = sock.recvfrom(4096)
+    except OSError:
+      return
+    query = dns.message.from_wire(data)
+    question = query.question[0]
+    qname = question.name.to_text()
+    if qname == "slow.example.":
+      continue
+    response = dns.message.make_response(query)
+    if qname == "ok.example.":
+      response.answer.append(dns.rrset.from_text(question.name, 300, "IN", "A", "192.0.2.1"))
+    elif qname == "broken.example.":
+      response.set_rcode(dns.rcode.SERVFAIL)
+    else:
+      response.set_rcode(dns.rcode.NXDOMAIN)
+    sock.sendto(response.to_wire(), address)
+
+class NormalizeNamesTest(unittest.TestCase):
+
+  def test_splits_and_collapses_wildcards(self):
+    names = crt_dns.normalize_names("*.Example.com\nwww.example.com.\n*.*.api.example.com\n")
+    self.assertEqual(names, {"example.com", "www.example.com", "api.example.com"})
+
+  def test_drops_malformed_names(self):
+    names = crt_dns.normalize_names("foo..example.com\n" + "a" * 64 + ".example.com\nok.example.com")
+    self.assertEqual(names, {"ok.example.com"})
+
+@unittest.skipIf(dns is None, "dnspython is not installed")
+class ResolveAllTest(unittest.TestCase):
+
+  def setUp(self):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.bind(("127.0.0.1", 0))
+    threading.Thread(target=serve_stub, args=(self.sock,), daemon=True).start()
+    self.resolver = crt_dns.build_resolver(["127.0.0.1"], self.sock.getsockname()[1], 0.5)
+
+  def tearDown(self):
+    self.sock.close()
+
+  def test_classifies_results(self):
+    hosts = ["ok.example", "missing.example", "broken.example", "slow.example", "foo..example", "a" * 64 + ".example"]
+    answers = crt_dns.resolve_all(hosts, self.resolver, concurrency=2)
+    self.assertEqual(answers["ok.example"], (crt_dns.RESOLVED, "ok.example."))
+    self.assertEqual(answers["missing.example"][0], crt_dns.NXDOMAIN)
+    self.assertEqual(answers["broken.example"][0], crt_dns.SERVFAIL)
+    self.assertEqual(answers["slow.example"][0], crt_dns.TIMEOUT)
+    self.assertEqual(answers["foo..example"][0], crt_dns.INVALID)
+    self.assertEqual(answers["a" * 64 + ".example"][0], crt_dns.INVALID)
+
+  def test_cache_skips_settled_names(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = os.path.join(directory, "cache.db")
+      crt_dns.resolve_all(["ok.example", "slow.example"], self.resolver, cache=cache)
+      self.sock.close()
+      # With the stub gone only the cached answer can still resolve.
+      answers = crt_dns.resolve_all(["ok.example", "slow.example"], self.resolver, cache=cache)
+      self.assertEqual(answers["ok.example"][0], crt_dns.RESOLVED)
+      self.assertEqual(answers["slow.example"][0], crt_dns.TIMEOUT)
+
+if __name__ == "__main__":
+  unittest.main()
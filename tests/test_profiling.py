@@ -0,0 +1,80 @@
+"""
+Tests for the shared --profile-out capture.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from secscripts import profiling
+
+def busy_worker(amount):
+  return sum(range(amount))
+
+class CpuProfileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.cmdargs = argparse.Namespace(profile_out=os.path.join(self.directory.name, "report.json"), profile_cpu=True, profile_memory=False)
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def read_report(self):
+    with open(self.cmdargs.profile_out) as file_handler:
+      return json.load(file_handler)
+
+  def busy_worker_calls(self, report):
+    return [entry["calls"] for entry in report["cprofile"] if entry["function"].endswith("(busy_worker)")]
+
+  @unittest.skipIf(sys.version_info >= (3, 12), "cProfile keeps one call stack for all threads from 3.12")
+  def test_worker_threads_are_profiled(self):
+    profiling.start(self.cmdargs)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+      list(executor.map(profiling.profiled(busy_worker), [10000] * 8))
+    profiling.write_report(self.cmdargs, top=1000)
+    report = self.read_report()
+    self.assertEqual(report["cprofile_threads"], "per-thread, calls still running are left out")
+    self.assertEqual(self.busy_worker_calls(report), [8])
+
+  def test_thread_that_outlives_the_report_stops_profiling(self):
+    profiled_call = threading.Event()
+    reported = threading.Event()
+    release = threading.Event()
+    seen = {}
+    def finish_call():
+      reported.wait()
+      seen["during"] = sys.getprofile()
+      release.wait()
+    def worker():
+      profiling.profiled(busy_worker)(10000)
+      seen["after_call"] = sys.getprofile()
+      profiled_call.set()
+      # Still running when the report is written, it must not keep a profiler.
+      profiling.profiled(finish_call)()
+      seen["after_report"] = sys.getprofile()
+      for _ in range(100):
+        busy_worker(100)
+    profiling.start(self.cmdargs)
+    thread = threading.Thread(target=worker)
+    thread.start()
+    profiled_call.wait()
+    profiling.write_report(self.cmdargs, top=1000)
+    reported.set()
+    release.set()
+    thread.join()
+    self.assertIsNone(seen["after_call"])
+    self.assertIsNone(seen["after_report"])
+    self.assertIsNone(profiling._worker_stats)
+    report = self.read_report()
+    self.assertNotIn("finish_call", json.dumps(report["cprofile"]))
+    if sys.version_info < (3, 12):
+      self.assertIsNotNone(seen["during"])
+      self.assertEqual(self.busy_worker_calls(report), [1])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,320 @@
+"""
+Tests for the Ubuntu CVE lookups, the status index and the local issue store.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from secscripts import ubuntu_cve
+
+TRACKER_CVE = """Candidate: CVE-2020-0001
+Patches_openssl:
+upstream_openssl: released (1.1.1g)
+xenial_openssl: ignored (end of standard support)
+esm-infra/xenial_openssl: released (1.0.2g-1ubuntu4.20+esm1)
+bionic_openssl: released (1.1.1-1ubuntu2.1~18.04.6)
+esm-infra/bionic_openssl: DNE
+focal_openssl: needed
+trusty_openssl: ignored (end of life)
+"""
+
+OVAL = """<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5">
+<definitions><definition class="vulnerability" id="oval:1">
+<metadata><reference source="CVE" ref_id="CVE-2020-0002" ref_url="https://example.com"/></metadata>
+<criteria>
+<criterion test_ref="t1" comment="curl package in jammy was vulnerable but has been fixed (note: '7.81.0-1ubuntu1.4')."/>
+<criterion test_ref="t2" comment="curl package in focal is affected and needs fixing."/>
+</criteria>
+</definition></definitions></oval_definitions>
+"""
+
+class BuildIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    tracker = os.path.join(self.directory.name, "tracker")
+    os.makedirs(os.path.join(tracker, "active"))
+    with open(os.path.join(tracker, "active", "CVE-2020-0001"), "w") as file_handler:
+      file_handler.write(TRACKER_CVE)
+    oval = os.path.join(self.directory.name, "oval.xml")
+    with open(oval, "w") as file_handler:
+      file_handler.write(OVAL)
+    self.index = os.path.join(self.directory.name, "index.db")
+    ubuntu_cve.build_index(self.index, [tracker, oval])
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def test_tracker_prefers_esm_status(self):
+    pages = ubuntu_cve.load_index(self.index, ["CVE-2020-0001"])
+    self.assertEqual(pages["CVE-2020-0001"]["openssl"], {"16.04": "released", "18.04": "released", "20.04": "needed"})
+
+  def test_oval_statuses(self):
+    pages = ubuntu_cve.load_index(self.index, ["CVE-2020-0002"])
+    self.assertEqual(pages["CVE-2020-0002"]["curl"], {"22.04": "released", "20.04": "needed"})
+
+OVAL_SECTIONS = """<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5">
+<definitions>
+<definition class="vulnerability" id="oval:1">
+<metadata><reference source="CVE" ref_id="CVE-2020-0003"/></metadata>
+<criteria><criterion test_ref="t1" comment="bash package in bionic is affected and needs fixing."/></criteria>
+</definition>
+<definition class="vulnerability" id="oval:2">
+<metadata><reference source="CVE" ref_id="CVE-2020-0004"/></metadata>
+<criteria><criterion test_ref="t2" comment="bash package in focal is not affected."/></criteria>
+</definition>
+</definitions>
+<tests><dpkginfo_test id="t1"><object object_ref="o1"/></dpkginfo_test></tests>
+<objects><dpkginfo_object id="o1"><name>bash</name></dpkginfo_object></objects>
+<states><dpkginfo_state id="s1"><evr>0:5.0</evr></dpkginfo_state></states>
+<variables><constant_variable id="v1"><value>bash</value></constant_variable></variables>
+</oval_definitions>
+"""
+
+class ReadOvalStatusesTest(unittest.TestCase):
+
+  def test_every_section_is_cleared_while_streaming(self):
+    with tempfile.TemporaryDirectory() as directory:
+      oval = os.path.join(directory, "oval.xml")
+      with open(oval, "w") as file_handler:
+        file_handler.write(OVAL_SECTIONS)
+      roots = []
+      iterparse = ubuntu_cve.etree.iterparse
+      def capture(source, events):
+        for event, element in iterparse(source, events):
+          if not roots:
+            roots.append(element)
+          yield event, element
+      with mock.patch.object(ubuntu_cve.etree, "iterparse", side_effect=capture):
+        statuses = list(ubuntu_cve.read_oval_statuses(oval))
+    self.assertEqual(statuses, [("CVE-2020-0003", "bash", "18.04", "needed"), ("CVE-2020-0004", "bash", "20.04", "not-affected")])
+    self.assertEqual(list(roots[0].iter()), [roots[0]])
+
+class ExpandStatusesTest(unittest.TestCase):
+
+  def test_binary_package_keeps_source_rows_apart(self):
+    pages = {"CVE-1": {"openssl": {"18.04": "needed"}, "openssl1.0": {"18.04": "not-affected"}}}
+    results = ubuntu_cve.expand_statuses({"libssl1.0.0": ["CVE-1"]}, pages)
+    self.assertEqual(results, [
+      ("libssl1.0.0", "openssl", "CVE-1", "18.04", "needed"),
+      ("libssl1.0.0", "openssl1.0", "CVE-1", "18.04", "not-affected"),
+    ])
+
+  def test_matching_source_package(self):
+    pages = {"CVE-1": {"openssl": {"18.04": "needed"}, "openssl1.0": {"18.04": "not-affected"}}}
+    results = ubuntu_cve.expand_statuses({"openssl": ["CVE-1"]}, pages)
+    self.assertEqual(results, [("openssl", "openssl", "CVE-1", "18.04", "needed")])
+
+CVE_PAGE = """<html><body><p>ignored</p><table>
+<tr><td>Source: <a href="#">openssl</a></td></tr>
+<tr><td>Ubuntu 18.04 LTS (Bionic Beaver)</td><td><span>released</span></td></tr>
+<tr><td>Ubuntu 20.04 LTS (Focal Fossa)</td><td><span>needed</span></td></tr>
+</table></body></html>"""
+
+class FakeAdapter(object):
+  """
+  Answers every request with the next queued (status, headers, body) and
+  remembers the requests it was sent.
+  """
+
+  def __init__(self, responses):
+    self.responses = list(responses)
+    self.sent = []
+
+  def send(self, request, **kwargs):
+    import requests
+    self.sent.append(request)
+    status, headers, body = self.responses.pop(0)
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    response._content = body
+    response.url = request.url
+    response.request = request
+    return response
+
+  def close(self):
+    pass
+
+class FetchCvePageTest(unittest.TestCase):
+
+  def setUp(self):
+    import requests
+    self.directory = tempfile.TemporaryDirectory()
+    self.cache = os.path.join(self.directory.name, "cache.db")
+    ubuntu_cve.create_cache(self.cache)
+    self.http_session = requests.Session()
+
+  def tearDown(self):
+    self.http_session.close()
+    self.directory.cleanup()
+
+  def mount(self, *responses):
+    adapter = FakeAdapter(responses)
+    self.http_session.mount("https://", adapter)
+    return adapter
+
+  def age_cache(self, cve, seconds):
+    fetched = ubuntu_cve.read_cache(self.cache, cve)[2]
+    conn = sqlite3.connect(self.cache)
+    conn.execute("update pages set fetched = ? where cve = ?", (fetched - seconds, cve))
+    conn.commit()
+    conn.close()
+
+  def test_download_is_cached_and_reused_within_ttl(self):
+    adapter = self.mount((200, {"ETag": '"v1"'}, b"page"))
+    self.assertEqual(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache), b"page")
+    self.assertEqual(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache), b"page")
+    self.assertEqual(len(adapter.sent), 1)
+    self.assertEqual(adapter.sent[0].url, "https://people.canonical.com/~ubuntu-security/cve/2020/CVE-2020-0001.html")
+
+  def test_not_modified_refreshes_timestamp(self):
+    adapter = self.mount((200, {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jun 2020 00:00:00 GMT"}, b"page"), (304, {}, b""))
+    ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache)
+    self.age_cache("CVE-2020-0001", ubuntu_cve.DEFAULT_CACHE_TTL + 60)
+    before = time.time()
+    self.assertEqual(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache), b"page")
+    self.assertEqual(adapter.sent[1].headers["If-None-Match"], '"v1"')
+    self.assertEqual(adapter.sent[1].headers["If-Modified-Since"], "Mon, 01 Jun 2020 00:00:00 GMT")
+    self.assertGreaterEqual(ubuntu_cve.read_cache(self.cache, "CVE-2020-0001")[2], before)
+    # Trusted again for another ttl, so no third request is made.
+    ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache)
+    self.assertEqual(len(adapter.sent), 2)
+
+  def test_changed_page_replaces_cache(self):
+    self.mount((200, {"ETag": '"v1"'}, b"old"), (200, {"ETag": '"v2"'}, b"new"))
+    ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache)
+    self.age_cache("CVE-2020-0001", ubuntu_cve.DEFAULT_CACHE_TTL + 60)
+    self.assertEqual(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache), b"new")
+    self.assertEqual(ubuntu_cve.read_cache(self.cache, "CVE-2020-0001")[0], '"v2"')
+
+  def test_offline_only_reads_cache(self):
+    adapter = self.mount((200, {}, b"page"))
+    ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache)
+    self.age_cache("CVE-2020-0001", ubuntu_cve.DEFAULT_CACHE_TTL + 60)
+    self.assertEqual(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0001", self.cache, offline=True), b"page")
+    self.assertIsNone(ubuntu_cve.fetch_cve_page(self.http_session, "CVE-2020-0002", self.cache, offline=True))
+    self.assertEqual(len(adapter.sent), 1)
+
+class LookupCvesTest(unittest.TestCase):
+
+  def test_each_cve_is_fetched_once(self):
+    fetched = []
+    lock = threading.Lock()
+    def fetch(http_session, cve, cache, ttl, offline):
+      with lock:
+        fetched.append(cve)
+      return CVE_PAGE
+    all_cves = {"openssl": ["CVE-1", "CVE-2"], "libssl1.1": ["CVE-1"], "libssl-dev": ["CVE-1", "CVE-2"]}
+    with mock.patch.object(ubuntu_cve, "fetch_cve_page", side_effect=fetch):
+      results = ubuntu_cve.lookup_cves(all_cves, workers=4, releases=["18.04"])
+    self.assertEqual(sorted(fetched), ["CVE-1", "CVE-2"])
+    self.assertEqual(sorted(results), [
+      ("libssl-dev", "openssl", "CVE-1", "18.04", "released"),
+      ("libssl-dev", "openssl", "CVE-2", "18.04", "released"),
+      ("libssl1.1", "openssl", "CVE-1", "18.04", "released"),
+      ("openssl", "openssl", "CVE-1", "18.04", "released"),
+      ("openssl", "openssl", "CVE-2", "18.04", "released"),
+    ])
+
+  def test_session_is_closed_on_error(self):
+    http_session = mock.Mock()
+    with mock.patch.object(ubuntu_cve, "build_http_session", return_value=http_session), \
+        mock.patch.object(ubuntu_cve, "fetch_cve_page", return_value=CVE_PAGE), \
+        mock.patch.object(ubuntu_cve, "parse_cve_page", side_effect=KeyboardInterrupt):
+      with self.assertRaises(KeyboardInterrupt):
+        ubuntu_cve.lookup_cves({"openssl": ["CVE-1"]}, workers=1)
+    http_session.close.assert_called_once_with()
+
+def sva_issue(issue_id, package, cves, last_seen, status="active"):
+  return {"id": issue_id, "issue_type": "sva", "package_name": package, "cve_ids": cves, "agent_id": "server-" + issue_id, "status": status, "last_seen_at": last_seen}
+
+class IssueStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.store = os.path.join(self.directory.name, "store.db")
+    ubuntu_cve.create_store(self.store)
+    self.pulls = []
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def sync(self, items, full=False):
+    def list_issues(issues, **filters):
+      self.pulls.append(filters)
+      for item in items:
+        if isinstance(item, Exception):
+          raise item
+        yield item
+    with mock.patch.object(ubuntu_cve, "list_issues", side_effect=list_issues):
+      return ubuntu_cve.sync_issues(self.store, None, full)
+
+  def query(self, sql):
+    conn = sqlite3.connect(self.store)
+    rows = conn.execute(sql).fetchall()
+    conn.close()
+    return rows
+
+  def test_full_sync_then_incremental_sync(self):
+    self.assertEqual(self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z"), sva_issue("2", "bash", ["CVE-2"], "2020-01-02T00:00:00Z")]), 2)
+    self.assertEqual(self.pulls[0], {"issue_type": "sva", "status": "active"})
+    self.assertEqual(self.query("select last_seen from syncinfo"), [("2020-01-02T00:00:00Z",)])
+    self.assertEqual(self.sync([sva_issue("3", "curl", ["CVE-3"], "2020-01-03T00:00:00Z")]), 1)
+    self.assertEqual(self.pulls[1], {"issue_type": "sva", "status": "active,resolved", ubuntu_cve.ISSUE_SINCE_FILTER: "2020-01-02T00:00:00Z"})
+    self.assertEqual(self.query("select last_seen from syncinfo"), [("2020-01-03T00:00:00Z",)])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store), {"bash": ["CVE-2"], "curl": ["CVE-3"], "openssl": ["CVE-1"]})
+
+  def test_resolved_issue_is_skipped(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z"), sva_issue("2", "bash", ["CVE-2"], "2020-01-01T00:00:00Z")])
+    ubuntu_cve.store_statuses(self.store, [("openssl", "openssl", "CVE-1", "18.04", "needed"), ("bash", "bash", "CVE-2", "18.04", "needed")], ["18.04"])
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-02T00:00:00Z", "resolved")])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04"], ttl=0), {"bash": ["CVE-2"]})
+    self.assertEqual(ubuntu_cve.read_store_statuses(self.store, ["18.04"]), [("bash", "bash", "CVE-2", "18.04", "needed")])
+
+  def test_full_sync_resolves_missing_issues(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z"), sva_issue("2", "bash", ["CVE-2"], "2020-01-01T00:00:00Z")])
+    self.assertEqual(self.sync([sva_issue("2", "bash", ["CVE-2"], "2020-01-02T00:00:00Z")], full=True), 2)
+    self.assertEqual(self.query("select id, status from issues order by id"), [("1", "resolved"), ("2", "active")])
+
+  def test_interrupted_pull_leaves_store_unchanged(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z")])
+    with self.assertRaises(IOError):
+      self.sync([sva_issue("2", "bash", ["CVE-2"], "2020-01-05T00:00:00Z"), IOError("connection reset")])
+    self.assertEqual(self.query("select last_seen from syncinfo"), [("2020-01-01T00:00:00Z",)])
+    self.assertEqual(self.query("select id from issues"), [("1",)])
+
+  def test_final_statuses_are_not_looked_up_again(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z"), sva_issue("2", "bash", ["CVE-2"], "2020-01-01T00:00:00Z")])
+    ubuntu_cve.store_statuses(self.store, [
+      ("openssl", "openssl", "CVE-1", "18.04", "released"),
+      ("openssl", "openssl", "CVE-1", "20.04", "not-affected"),
+      ("bash", "bash", "CVE-2", "18.04", "released"),
+      ("bash", "bash", "CVE-2", "20.04", "needed"),
+    ], ["18.04", "20.04"])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04", "20.04"]), {})
+    # Only the pair that is still waiting for a fix is looked up once the ttl has passed.
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04", "20.04"], ttl=0), {"bash": ["CVE-2"]})
+    ubuntu_cve.store_statuses(self.store, [("bash", "bash", "CVE-2", "18.04", "released"), ("bash", "bash", "CVE-2", "20.04", "released")], ["18.04", "20.04"])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04", "20.04"], ttl=0), {})
+    self.assertEqual(ubuntu_cve.read_store_statuses(self.store, ["20.04"]), [("bash", "bash", "CVE-2", "20.04", "released"), ("openssl", "openssl", "CVE-1", "20.04", "not-affected")])
+
+  def test_new_release_is_looked_up(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z")])
+    ubuntu_cve.store_statuses(self.store, [("openssl", "openssl", "CVE-1", "16.04", "released")], ["16.04"])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["16.04"]), {})
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["16.04", "22.04"]), {"openssl": ["CVE-1"]})
+
+  def test_full_sync_forgets_unfinished_lookups(self):
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-01T00:00:00Z")])
+    ubuntu_cve.store_statuses(self.store, [("openssl", "openssl", "CVE-1", "18.04", "needs-triage")], ["18.04"])
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04"]), {})
+    self.sync([sva_issue("1", "openssl", ["CVE-1"], "2020-01-02T00:00:00Z")], full=True)
+    self.assertEqual(ubuntu_cve.get_unchecked_cves(self.store, ["18.04"]), {"openssl": ["CVE-1"]})
+
+if __name__ == "__main__":
+  unittest.main()